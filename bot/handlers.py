@@ -1,3 +1,4 @@
+import asyncio
 import os
 from io import BytesIO
 from pathlib import Path
@@ -341,7 +342,8 @@ async def handle_pdf(message: Message):
     src_tmp_path = await _save_temp_pdf(data, document.file_name, user_id)
 
     try:
-        report = split_pdf_by_meta(src_tmp_path)
+        # разбор страниц — синхронный и тяжёлый: уводим в поток, чтобы бот не замирал
+        report = await asyncio.to_thread(split_pdf_by_meta, src_tmp_path)
 
         if not report["outputs"]:
             msg = (
@@ -32,9 +32,8 @@ async def _download_document_bytes(bot, file_id: str) -> bytes:
             raise FileTooBigError("Telegram: file is too big") from e
         raise
 
-    file = await bot.get_file(file_id)
     buf = io.BytesIO()
-    await bot.download(file, buf)
+    await bot.download(tg_file, buf)
     buf.seek(0)
     return buf.getvalue()
 
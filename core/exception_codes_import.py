@@ -8,7 +8,7 @@ from typing import Dict, Any
 import pandas as pd
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from services.printed_codes import register_code_if_new
+from services.printed_codes import bulk_register_codes
 
 ALLOWED_PREFIXES = ("01046", "01029")
 
@@ -57,18 +57,14 @@ async def import_exception_codes(session: AsyncSession, data: bytes) -> Dict[str
         if not _is_valid_code(s):
             invalid += 1
             continue
-        if s in seen:
-            continue
         seen.add(s)
 
-        try:
-            is_new = await register_code_if_new(session, s)
-            if is_new:
-                added += 1
-            else:
-                duplicates += 1
-        except Exception:
-            invalid += 1
+    # одна массовая вставка вместо запроса на каждый код
+    try:
+        added = await bulk_register_codes(session, seen)
+        duplicates = len(seen) - added
+    except Exception:
+        invalid += len(seen)
 
     await session.commit()
 
@@ -43,22 +43,26 @@ COLOR_STOP = re.compile(
 )
 
 # ==== Общие регулярки / токены ====
-RE_GTIN              = re.compile(r"^0\d{13,}$")
-RE_SERIAL            = re.compile(r"^[\x20-\x7E]{4,}$")
-RE_ASCII_PREFIX      = re.compile(r"^([\x21-\x7E]{4,})")
+# re.ASCII — там, где кроме ASCII-классов ничего нет. Где есть \s, флаг не ставим:
+# в тексте PDF между частями кода встречаются неразрывные пробелы.
+RE_GTIN              = re.compile(r"^0\d{13,}$", re.ASCII)
+RE_SERIAL            = re.compile(r"^[\x20-\x7E]{4,}$", re.ASCII)
+RE_ASCII_PREFIX      = re.compile(r"^([\x21-\x7E]{4,})", re.ASCII)
 RE_ASCII_PREFIX_LINE = re.compile(r"^\s*([!-~]{4,})")
 RE_ASCII_ANY = re.compile(r"[!-~’]{4,}")
 
 SERIAL_MIN = 9
 SERIAL_MAX = 13
 
-RE_ASCII_RUN = re.compile(r"[!-~]{%d,}" % SERIAL_MIN)
+RE_ASCII_RUN = re.compile(r"[!-~]{%d,}" % SERIAL_MIN, re.ASCII)
 
-RE_GS1_NOPAREN_ANY = re.compile(r"01\s*\d{14}\s*21", re.IGNORECASE)
+# в головах GS1 букв нет — IGNORECASE (юникодный casefold на каждый символ) не нужен
+RE_GS1_NOPAREN_ANY = re.compile(r"01\s*\d{14}\s*21")
+RE_GS1_PAREN_HEAD  = re.compile(r"\(\s*01\s*\)\s*\d{14}\s*\(\s*21\s*\)")
 
 # GS1 линии
-RE_GS1_PAREN_ONELINE    = re.compile(r"\(\s*01\s*\)\s*\d{14}\s*\(\s*21\s*\)\s*[!-~]{4,}", re.IGNORECASE)
-RE_GS1_NOPAREN_HEADLINE = re.compile(r"^\s*01\s*\d{14}\s*21\s*$", re.IGNORECASE)
+RE_GS1_PAREN_ONELINE    = re.compile(r"\(\s*01\s*\)\s*\d{14}\s*\(\s*21\s*\)\s*[!-~]{4,}")
+RE_GS1_NOPAREN_HEADLINE = re.compile(r"^\s*01\s*\d{14}\s*21\s*$")
 
 # Артикул / Цвет / Лейблы
 RE_ART        = re.compile(r"Артикул\s*[:\-]?\s*(.+?)(?=(?:\s*Цвет\s*:|\s*Размер\s*:|$))", re.IGNORECASE)
@@ -97,4 +101,6 @@ SIZE_WORDS   = {
     "ONE SIZE","ONESIZE","UNI","UNISIZE","UNIVERSAL",
     "УНИВЕРСАЛЬНЫЙ","ЕДИНЫЙ РАЗМЕР","ДЕТСКИЙ","ПОДРОСТКОВЫЙ"
 }
+# NEW: верхний регистр считаем один раз, а не на каждое совпадение RE_SIZE_WORD
+SIZE_WORDS_UPPER = frozenset(w.upper() for w in SIZE_WORDS)
 RE_SIZE_WORD = re.compile(r"\b[A-Za-zА-Яа-яЁё\- ]{3,}\b", re.IGNORECASE)
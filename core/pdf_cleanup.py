@@ -1,15 +1,15 @@
 from pathlib import Path
-import pdfplumber
 from PyPDF2 import PdfReader
 
 from sqlalchemy.ext.asyncio import AsyncSession
 from services.printed_codes import get_all_codes
 from core.pdf_rw import (
     PDF_DIR,
-    _extract_code_from_text,
+    _pdfium_document,
+    _pdfium_page_count,
+    _extract_page_code,
     _build_tail_writer,
     _write_pdf,
-    _replace_file,
 )
 
 def _is_tmp_name(name: str) -> bool:
@@ -54,37 +54,48 @@ async def purge_known_codes_in_dir(
             continue
 
         stats["files_scanned"] += 1
-        try:
-            reader = PdfReader(str(pdf_path))
-        except Exception as e:
-            stats["details"].append(f"⚠️ {name}: не удалось открыть ({e})")
-            continue
-
-        total_pages = len(reader.pages)
-        if total_pages == 0:
-            pdf_path.unlink(missing_ok=True)
-            stats["files_deleted"] += 1
-            stats["details"].append(f"🗑 {name}: пустой файл удалён")
-            continue
-
-        keep_indexes = set()
+        keep_indexes: list[int] = []  # по возрастанию — как идём по страницам
         deleted_here = 0
 
+        # текст страниц — через PDFium (как в нарезке); раскладка pdfplumber тут не нужна
         try:
-            with pdfplumber.open(str(pdf_path)) as pl_pdf:
+            with _pdfium_document(str(pdf_path)) as doc:
+                total_pages = _pdfium_page_count(doc)
                 for i in range(total_pages):
                     stats["pages_scanned"] += 1
-                    txt = pl_pdf.pages[i].extract_text(x_tolerance=1.0, y_tolerance=1.0) or ""
-                    code = _extract_code_from_text(txt)
+                    code = _extract_page_code(doc, i)
                     if code and code in all_codes:
                         deleted_here += 1
                         continue
-                    keep_indexes.add(i)
+                    keep_indexes.append(i)
+        except Exception as e:
+            stats["details"].append(f"⚠️ {name}: не удалось открыть ({e})")
+            continue
+
+        if total_pages and deleted_here == 0:
+            continue
+
+        # PyPDF2 разбирает файл только если его действительно нужно менять или удалять.
+        # Страницы выбирал PDFium — сверяем число страниц (как в нарезке и разбивке):
+        # иначе _build_tail_writer молча потеряет «лишние» страницы, а «пустой»
+        # по мнению PDFium файл удалился бы без проверки
+        try:
+            reader = PdfReader(str(pdf_path))
+            reader_pages = len(reader.pages)
         except Exception as e:
-            stats["details"].append(f"⚠️ {name}: ошибка чтения ({e})")
+            stats["details"].append(f"⚠️ {name}: не удалось открыть ({e})")
+            continue
+        if reader_pages != total_pages:
+            stats["details"].append(
+                f"⚠️ {name}: число страниц PDFium ({total_pages}) и PyPDF2 ({reader_pages}) "
+                f"не совпадает, файл пропущен"
+            )
             continue
 
-        if deleted_here == 0:
+        if total_pages == 0:
+            pdf_path.unlink(missing_ok=True)
+            stats["files_deleted"] += 1
+            stats["details"].append(f"🗑 {name}: пустой файл удалён")
             continue
 
         stats["pages_deleted"] += deleted_here
@@ -97,12 +108,9 @@ async def purge_known_codes_in_dir(
 
         # Пересобираем PDF без удалённых страниц
         try:
-            writer = _build_tail_writer(reader, total_pages, keep_indexes)
-            tmp_dir = pdf_path.parent / "tmp"
-            tmp_dir.mkdir(parents=True, exist_ok=True)
-            tmp_path = tmp_dir / f"{pdf_path.stem}__purged_tmp.pdf"
-            _write_pdf(writer, tmp_path)
-            _replace_file(tmp_path, pdf_path)
+            writer = _build_tail_writer(reader, keep_indexes)
+            # _write_pdf публикует файл атомарно (tmp рядом + os.replace)
+            _write_pdf(writer, pdf_path)
             stats["files_modified"] += 1
             stats["details"].append(
                 f"✂️ {name}: удалено {deleted_here} из {total_pages} страниц"
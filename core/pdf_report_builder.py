@@ -12,13 +12,20 @@ from PyPDF2 import PdfReader
 from .patterns import (
     PDF_DIR,
     RE_COLOR, RE_NAME_COLOR, RE_COLOR_DASH_LINE, RE_COLOR_TOKEN,
-    RE_SIZE_LABEL, RE_SIZE_ALPHA, RE_SIZE_NUMERIC, RE_SIZE_WORD, SIZE_WORDS,
+    RE_SIZE_LABEL, RE_SIZE_ALPHA, RE_SIZE_NUMERIC, RE_SIZE_WORD, SIZE_WORDS_UPPER,
     RE_ART, RE_ART_ALT1, RE_ART_ALT2, FALLBACK_PRODUCTS, FALLBACK_COLOR_WORDS,
 )
-from .text_clean import clean_for_parsing, normalize_dashes, strip_gs1, clean_color_value
+from .text_clean import collapse_repeats, clean_for_parsing, normalize_dashes, strip_gs1, clean_color_value
 
 __all__ = ["build_inventory_report_excel_bytes"]
 
+_RE_COLOR_WORD = re.compile(r"[А-ЯЁ-]{4,}")
+_RE_NAME_TAIL = re.compile(r"__\d+p_.*$")
+_RE_TRAIL_DASH = re.compile(r"[-–—]+$")
+_RE_DASHES = re.compile(r"[–—]")
+_RE_SEP_WS = re.compile(r"\s*([\-\/])\s*")
+_RE_WS = re.compile(r"\s+")
+
 
 # ---------- базовые утилиты ----------
 
@@ -35,7 +42,7 @@ def _extract_article_fallback(text: str) -> Optional[str]:
 
 def _extract_color_fallback(lines: list[str]) -> Optional[str]:
     for ln in lines:
-        words = re.findall(r"[А-ЯЁ-]{4,}", ln.upper())
+        words = _RE_COLOR_WORD.findall(ln.upper())
 
         for w in words:
             if w in FALLBACK_COLOR_WORDS:
@@ -60,7 +67,7 @@ def _color_from_filename(path: Path) -> Optional[str]:
     if len(parts) >= 3:
         raw = parts[2]
         # Np_ и дата идут уже после следующего "__" — нам не мешают
-        raw = re.sub(r"__\d+p_.*$", "", raw)
+        raw = _RE_NAME_TAIL.sub("", raw)
         return clean_color_value(raw)
     return None
 
@@ -75,27 +82,18 @@ def _first_page_text(pdf_path: Path) -> str:
     return t
 
 
-def _dedupe_concat(s: str) -> str:
-    """Схлопывает дубли 'XXX' -> 'X' при склейке переносов."""
-    while True:
-        m = re.fullmatch(r"(.+?)\1+", s)
-        if not m:
-            return s
-        s = m.group(1)
-
-
 def _cleanup_article(s: str) -> str:
     # отрезаем всё после «Цвет», убираем хвостовые тире/двоеточие, схлопываем дубли
     s = RE_COLOR_TOKEN.split(s, maxsplit=1)[0]
-    s = re.sub(r"[-–—]+$", "", s).strip().rstrip(":").strip()
-    return _dedupe_concat(s)
+    s = _RE_TRAIL_DASH.sub("", s).strip().rstrip(":").strip()
+    return collapse_repeats(s)
 
 
 def _clean_size(s: str) -> str:
     s = (s or "").strip()
-    s = re.sub(r"[–—]", "-", s)                 # нормализуем типы тире
-    s = re.sub(r"\s*([\-\/])\s*", r"\1", s)     # пробелы вокруг - и /
-    s = re.sub(r"\s+", " ", s).strip()
+    s = _RE_DASHES.sub("-", s)          # нормализуем типы тире
+    s = _RE_SEP_WS.sub(r"\1", s)        # пробелы вокруг - и /
+    s = _RE_WS.sub(" ", s).strip()
     return s
 
 
@@ -126,10 +124,9 @@ def _extract_size_from_text(text: str) -> Optional[str]:
                 s = m.group(0)
             else:
                 s = None
-                words_upper = {w.upper() for w in SIZE_WORDS}
                 for mm in RE_SIZE_WORD.finditer(t):
                     cand = mm.group(0)
-                    if cand.upper() in words_upper:
+                    if cand.upper() in SIZE_WORDS_UPPER:
                         s = cand
                         break
     return _clean_size(s) if s else None
@@ -1,28 +1,55 @@
+import functools
+import hashlib
+import io
+import mmap
 import os
+import shutil
+import threading
 import time
+from fnmatch import fnmatchcase
+from contextlib import ExitStack, contextmanager
 from dataclasses import dataclass
-from typing import Optional, Tuple
+from typing import Iterator, Optional, Tuple
 
-import pdfplumber
+import pypdfium2 as pdfium
 from PyPDF2 import PdfReader, PdfWriter
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from config import config
-from services.printed_codes import register_code_if_new, bulk_register_codes, get_all_codes
+from services.order_logging import parse_qty
+from services.printed_codes import bulk_register_codes, get_all_codes
 from .patterns import *
 import asyncio
 
-from .text_clean import clean_color_value
+from .text_clean import clean_color_value, normalize_dashes
 
 # глобальная "бронь" кодов на время одной сборки
 _codes_lock = asyncio.Lock()
 
 # кеш текста PDF для поиска по артикулу/размеру
-_pdf_text_cache: dict[Path, str] = {}
+_pdf_text_cache: dict[Path, "PdfText"] = {}
+
+# дисковый кеш извлечённого текста (ключ — хеш содержимого PDF), переживает рестарты.
+# Подкаталог — версия способа извлечения текста: сменился экстрактор/формат -> новая версия,
+# старые каталоги удаляет _prune_text_cache
+_TEXT_CACHE_ROOT = PDF_DIR / ".txtcache"
+_TEXT_CACHE_VERSION = "pdfium-v1"
+TEXT_CACHE_DIR = _TEXT_CACHE_ROOT / _TEXT_CACHE_VERSION
+_TEXT_CACHE_MAX_AGE = 14 * 24 * 3600  # запись не запрашивали две недели — удаляем
+_TEXT_CACHE_MAX_BYTES = 256 << 20     # сверх этого удаляем самые давние записи
+_TEXT_CACHE_PRUNE_EVERY = 3600        # чистим не чаще раза в час
+_text_cache_pruned_at = 0.0
+_text_cache_prune_lock = threading.Lock()
+
+# PDFium не потокобезопасен: все его вызовы в процессе — под одним локом
+_pdfium_lock = threading.Lock()
+
+# текст страниц одного PDF извлекаем пачками
+_MIN_PAGE_BATCH = 4
+_PAGE_BATCH = 16
 
 # локи на каждый pdf, т.к. мы модифицируем исходник (удаляем страницы)
 _pdf_locks: dict[Path, asyncio.Lock] = {}
-_pdf_locks_lock = asyncio.Lock()
 
 
 @dataclass(frozen=True)
@@ -31,35 +58,184 @@ class CutResult:
     shortage: int
 
 
+@dataclass(frozen=True)
+class PdfText:
+    digest: str  # хеш содержимого файла (ключ дискового кеша)
+    stamp: tuple[int, int]  # (st_mtime_ns, st_size) на момент чтения — для проверки свежести
+    raw: str
+    flat: str  # без пробельных символов, в нижнем регистре — для поиска артикула
+    upper: str  # в верхнем регистре — для дешёвой предпроверки размера
+
+
 # 🔧 helpers (оффлоад синхронщины в поток)
 
+_RE_UNSAFE_NAME = re.compile(r"[^\w\-\.\s/]+", re.UNICODE)
+_RE_COLOR_WORD = re.compile(r"[А-ЯЁ-]{4,}")
+_RE_LEADING_DIGIT = re.compile(r"\d")
+
+# пробел -> "_", "/" -> "-" за один проход вместо двух str.replace
+_SAFE_NAME_TABLE = str.maketrans({" ": "_", "/": "-"})
+
+
+@functools.lru_cache(maxsize=1024)
 def _safe_name(s: str) -> str:
     s = s.strip()
-    s = re.sub(r"[^\w\-\.\s/]+", "_", s, flags=re.UNICODE)
-    s = s.replace(" ", "_").replace("/", "-")
+    # regex оставляем: серия запрещённых символов схлопывается в один "_",
+    # иначе имена перестанут совпадать с уже сохранёнными файлами
+    s = _RE_UNSAFE_NAME.sub("_", s)
+    s = s.translate(_SAFE_NAME_TABLE)
     return s[:120] if len(s) > 120 else s
 
-def get_pdf_text_cached(p: Path) -> str:
-    """NEW: кешируем read_pdf для ускорения поиска PDF по артикулу/размеру."""
+def get_pdf_text_cached(p: Path) -> PdfText:
+    """
+    NEW: кешируем read_pdf для ускорения поиска PDF по артикулу/размеру.
+    Вместе с текстом храним его "плоскую" форму, чтобы не пересчитывать её на каждую строку заказа.
+    Запись считается свежей, пока у файла не поменялись mtime и размер
+    (файл могли перезалить под тем же именем в обход invalidate_pdf_cache).
+    """
+    st = p.stat()
+    stamp = (st.st_mtime_ns, st.st_size)
     t = _pdf_text_cache.get(p)
-    if t is None:
-        t = read_pdf(p)
+    if t is None or t.stamp != stamp:
+        digest, raw = _read_pdf_disk_cached(p)
+        t = PdfText(digest=digest, stamp=stamp, raw=raw, flat=_strip_all_ws(raw), upper=raw.upper())
         _pdf_text_cache[p] = t
     return t
 
 def invalidate_pdf_cache(p: Path) -> None:
     """NEW: сбрасываем кеш, если PDF был изменён (мы его урезали)."""
-    _pdf_text_cache.pop(p, None)
+    t = _pdf_text_cache.pop(p, None)
+    if t is not None:
+        # старое содержимое больше не встретится — запись на диске не нужна
+        (TEXT_CACHE_DIR / f"{t.digest}.txt").unlink(missing_ok=True)
+
 
+def _pdf_digest(path: Path) -> str:
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _read_pdf_disk_cached(path: Path) -> tuple[str, str]:
+    """
+    Текст PDF через дисковый кеш: хеш файла дешевле повторного извлечения текста.
+    Возвращает (digest, text). Запись — через tmp + os.replace, чтобы не оставить обрывок.
+    """
+    _prune_text_cache()
+    digest = _pdf_digest(path)
+    cache_file = TEXT_CACHE_DIR / f"{digest}.txt"
+    try:
+        text = cache_file.read_text(encoding="utf-8")
+    except FileNotFoundError:
+        pass
+    else:
+        # mtime = время последнего обращения: по нему чистим старые записи
+        try:
+            os.utime(cache_file)
+        except OSError:
+            pass
+        return digest, text
 
-async def get_pdf_lock(p: Path) -> asyncio.Lock:
-    """NEW: гарантируем один lock на путь."""
-    async with _pdf_locks_lock:
-        lock = _pdf_locks.get(p)
-        if lock is None:
-            lock = asyncio.Lock()
-            _pdf_locks[p] = lock
-        return lock
+    # не read_pdf: тот глотает ошибку и отдаёт "", а пустой текст в кеше остался бы навсегда
+    try:
+        text = "\n".join(iter_pdf_pages(path))
+    except Exception as e:
+        print(f"[read_pdf] failed {path}: {e}")
+        return digest, ""
+
+    # кеш — только ускорение: не смогли сохранить (диск полон, каталог только на чтение) —
+    # всё равно отдаём текст, иначе поиск молча потеряет этот PDF
+    tmp = TEXT_CACHE_DIR / f"{digest}.{threading.get_ident()}.tmp"
+    try:
+        TEXT_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        tmp.write_text(text, encoding="utf-8")
+        os.replace(tmp, cache_file)
+    except OSError as e:
+        print(f"[text_cache] not saved {path}: {e}")
+        try:
+            tmp.unlink(missing_ok=True)
+        except OSError:
+            pass
+    return digest, text
+
+
+def _prune_text_cache() -> None:
+    """
+    Чистка дискового кеша текста (не чаще _TEXT_CACHE_PRUNE_EVERY):
+    - каталоги/файлы других версий экстрактора;
+    - записи, к которым не обращались дольше _TEXT_CACHE_MAX_AGE
+      (сюда же уходят тексты удалённых/перезаписанных PDF и разовых выгрузок);
+    - самые давние записи, пока кеш больше _TEXT_CACHE_MAX_BYTES.
+    """
+    global _text_cache_pruned_at
+    now = time.time()
+    if now - _text_cache_pruned_at < _TEXT_CACHE_PRUNE_EVERY:
+        return
+    # чистит один поток, остальные не ждут
+    if not _text_cache_prune_lock.acquire(blocking=False):
+        return
+    try:
+        _text_cache_pruned_at = now
+        if not _TEXT_CACHE_ROOT.is_dir():
+            return
+
+        with os.scandir(_TEXT_CACHE_ROOT) as it:
+            for e in it:
+                if e.name == _TEXT_CACHE_VERSION:
+                    continue
+                try:
+                    if e.is_dir(follow_symlinks=False):
+                        shutil.rmtree(e.path, ignore_errors=True)
+                    else:
+                        os.unlink(e.path)
+                except OSError:
+                    pass
+
+        if not TEXT_CACHE_DIR.is_dir():
+            return
+        entries: list[tuple[float, int, str]] = []
+        total = 0
+        with os.scandir(TEXT_CACHE_DIR) as it:
+            for e in it:
+                try:
+                    st = e.stat(follow_symlinks=False)
+                    if now - st.st_mtime > _TEXT_CACHE_MAX_AGE:
+                        os.unlink(e.path)
+                        continue
+                except OSError:
+                    continue
+                # .tmp может прямо сейчас дописывать другой поток — по размеру не трогаем
+                if e.name.endswith(".txt"):
+                    entries.append((st.st_mtime, st.st_size, e.path))
+                    total += st.st_size
+
+        if total > _TEXT_CACHE_MAX_BYTES:
+            entries.sort()
+            for _, size, path in entries:
+                try:
+                    os.unlink(path)
+                except OSError:
+                    continue
+                total -= size
+                if total <= _TEXT_CACHE_MAX_BYTES:
+                    break
+    except OSError as e:
+        print(f"[text cache] prune failed: {e}")
+    finally:
+        _text_cache_prune_lock.release()
+
+
+def get_pdf_lock(p: Path) -> asyncio.Lock:
+    """
+    NEW: гарантируем один lock на путь.
+    Между await'ами event loop однопоточный, поэтому отдельный lock на сам словарь не нужен.
+    """
+    lock = _pdf_locks.get(p)
+    if lock is None:
+        lock = _pdf_locks[p] = asyncio.Lock()
+    return lock
 
 
 
@@ -74,7 +250,7 @@ def _extract_article_fallback(text: str) -> Optional[str]:
 
 def _extract_color_fallback(lines: list) -> Optional[str]:
      for ln in lines:
-         words = re.findall(r"[А-ЯЁ-]{4,}", ln.upper())
+         words = _RE_COLOR_WORD.findall(ln.upper())
 
          for w in words:
              if w in FALLBACK_COLOR_WORDS:
@@ -85,8 +261,8 @@ def _extract_color_fallback(lines: list) -> Optional[str]:
 
 def _norm_size_for_fname(size: str) -> str:
     s = str(size).strip()
-    s = s.replace("–", "-").replace("—", "-")
-    s = re.sub(r"\s+", "", s)
+    s = normalize_dashes(s)
+    s = s.translate(_WS_DELETE)
     return s
 
 
@@ -108,130 +284,191 @@ async def _to_thread(func, *args, **kwargs):
     return await asyncio.to_thread(func, *args, **kwargs)
 
 
+# PdfWriter пишет объектами по несколько байт — крупный буфер вместо 8 КБ по умолчанию
+_WRITE_BUFFER = 1 << 20
+
+
 def _write_pdf(writer: PdfWriter, out_path: Path) -> None:
+    """
+    Пишем во временный файл рядом и публикуем через os.replace:
+    при сбое посреди записи на месте out_path не останется обрывка.
+    """
     out_path.parent.mkdir(parents=True, exist_ok=True)
-    with open(out_path, "wb") as f:
-        writer.write(f)
+    # не mkstemp: тот создаёт файл с правами 0600, а после os.replace они достались бы
+    # исходнику/части. open(..., "xb") даёт обычные права по umask, "x" не затрёт чужой файл
+    tmp = out_path.with_name(f".{out_path.stem}.{os.urandom(6).hex()}.tmp")
+    f = open(tmp, "xb", buffering=_WRITE_BUFFER)
+    try:
+        with f:
+            writer.write(f)
+        os.replace(tmp, out_path)
+    except BaseException:
+        tmp.unlink(missing_ok=True)
+        raise
 
 def _replace_file(tmp_path: Path, target: Path) -> None:
     os.replace(tmp_path, target)
 
 def _strip_all_ws(s: str) -> str:
-    return re.sub(r"\s+", "", s).lower()
+    return s.translate(_WS_DELETE).lower()
+
+@functools.lru_cache(maxsize=1024)
+def _article_no_ws(article: str) -> str:
+    """_strip_all_ws для артикула: одни и те же артикулы повторяются в строках с разными размерами.
+    Для текста PDF не используем — его "плоская" форма уже лежит в PdfText."""
+    return _strip_all_ws(article)
 
 def _ascii_prefix(line: str) -> Optional[str]:
     m = RE_ASCII_PREFIX.match(line)
     return m.group(1) if m else None
 
 
-def _extract_code_from_text(text: str) -> Optional[str]:
-    """
-    Ищем GS1: (01)<14 цифр>(21)<ASCII-serial> (со/без скобок).
-    Серийник может идти сразу после (21) или на следующих строках — не обязательно с начала.
-    После сборки валидируем общую длину 27..31.
-    """
-    if not text:
-        return None
+# таблица для str.translate: удаляет все пробельные символы (то же множество, что \s в re)
+_WS_DELETE = {c: None for c in range(0x3001) if chr(c).isspace()}
 
-    # 0) Всё в одной строке со скобками
-    m_one = RE_GS1_PAREN_ONELINE.search(text)
-    if m_one:
-        candidate = re.sub(r"\s+", "", m_one.group(0))
-        return candidate if 27 <= len(candidate) <= 35 else None
+_GS1_LOOKAHEAD = 4  # сколько строк дальше смотрим
+
+
+def _pack_code(head: str, tail: str) -> Optional[str]:
+    s = head.translate(_WS_DELETE) + tail.translate(_WS_DELETE)
+    return s if 27 <= len(s) <= 31 else None
 
-    lines = [ln.strip() for ln in text.splitlines() if ln.strip()]
-    if not lines:
-        return None
 
-    def pack(head: str, tail: str) -> Optional[str]:
-        s = re.sub(r"\s+", "", head) + re.sub(r"\s+", "", tail)
-        return s if 27 <= len(s) <= 31 else None
+def _code_oneline(text: str) -> Tuple[bool, Optional[str]]:
+    """(нашлось ли "всё в одной строке", код) — при совпадении дальше не ищем."""
+    m_one = RE_GS1_PAREN_ONELINE.search(text)
+    if not m_one:
+        return False, None
+    candidate = m_one.group(0).translate(_WS_DELETE)
+    return True, (candidate if 27 <= len(candidate) <= 35 else None)
 
-    LOOKAHEAD = 4  # сколько строк дальше смотрим
 
-    # 1) Со скобками: "(01)…..(21)" в строке i, серийник на этой же или следующих строках (в любом месте)
-    head_pat = re.compile(r"\(\s*01\s*\)\s*\d{14}\s*\(\s*21\s*\)")  # только "голову"
+def _code_after_head(lines: list[str], head_pat: re.Pattern, head_from_line_start: bool) -> Optional[str]:
+    """
+    Голова GS1 в строке i, серийник — на этой же или следующих строках (в любом месте).
+    """
     for i, ln in enumerate(lines):
         mh = head_pat.search(ln)
         if not mh:
             continue
-        head = ln[:mh.end()]
+        head = ln[:mh.end()] if head_from_line_start else ln[mh.start():mh.end()]
         tail_same = ln[mh.end():]
+        next_lines = lines[i + 1:min(i + 1 + _GS1_LOOKAHEAD, len(lines))]
 
         # серийник может быть где угодно в хвосте строки (НЕ только с начала)
         m_same = RE_ASCII_ANY.search(tail_same)
         if m_same:
-            cand = pack(head, m_same.group(0))
+            cand = _pack_code(head, m_same.group(0))
             if cand:
                 return cand
 
         # либо на одной из следующих строк — тоже не обязательно с начала
-        for j in range(i + 1, min(i + 1 + LOOKAHEAD, len(lines))):
-            m_next = RE_ASCII_ANY.search(lines[j])
+        for nxt in next_lines:
+            m_next = RE_ASCII_ANY.search(nxt)
             if m_next:
-                cand = pack(head, m_next.group(0))
+                cand = _pack_code(head, m_next.group(0))
                 if cand:
                     return cand
 
         # попробуем «склеить» хвост и пару следующих строк на случай разрывов
-        glued = tail_same + " " + " ".join(lines[i + 1:min(i + 1 + LOOKAHEAD, len(lines))])
+        glued = tail_same + " " + " ".join(next_lines)
         m_glued = RE_ASCII_ANY.search(glued)
         if m_glued:
-            cand = pack(head, m_glued.group(0))
+            cand = _pack_code(head, m_glued.group(0))
             if cand:
                 return cand
 
-    # 2) Без скобок: «01\d{14}21» как подстрока, серийник далее (где угодно)
-    noparen_head_any = re.compile(r"01\s*\d{14}\s*21")
-    for i, ln in enumerate(lines):
-        mh = noparen_head_any.search(ln)
-        if not mh:
-            continue
-        head = ln[mh.start():mh.end()]
-        tail_same = ln[mh.end():]
+    return None
 
-        m_same = RE_ASCII_ANY.search(tail_same)
-        if m_same:
-            cand = pack(head, m_same.group(0))
-            if cand:
-                return cand
 
-        for j in range(i + 1, min(i + 1 + LOOKAHEAD, len(lines))):
-            m_next = RE_ASCII_ANY.search(lines[j])
-            if m_next:
-                cand = pack(head, m_next.group(0))
-                if cand:
-                    return cand
+# построчные форматы GS1 в порядке приоритета: (голова, брать ли голову с начала строки)
+_GS1_HEADS = (
+    (RE_GS1_PAREN_HEAD, True),     # со скобками: только "голову" "(01)…(21)"
+    (RE_GS1_NOPAREN_ANY, False),   # без скобок: «01\d{14}21» как подстрока
+)
 
-        glued = tail_same + " " + " ".join(lines[i + 1:min(i + 1 + LOOKAHEAD, len(lines))])
-        m_glued = RE_ASCII_ANY.search(glued)
-        if m_glued:
-            cand = pack(head, m_glued.group(0))
-            if cand:
-                return cand
+
+def _extract_code_from_text(text: str) -> Optional[str]:
+    """
+    Ищем GS1: (01)<14 цифр>(21)<ASCII-serial> (со/без скобок).
+    Серийник может идти сразу после (21) или на следующих строках — не обязательно с начала.
+    После сборки валидируем общую длину 27..31.
+    """
+    # все форматы содержат литералы "01" и "21" — без них regex'ы не запускаем
+    if not text or "21" not in text or "01" not in text:
+        return None
+
+    # 0) Всё в одной строке со скобками
+    matched, code = _code_oneline(text)
+    if matched:
+        return code
+
+    # 1) со скобками, 2) без скобок.
+    # Формат, чьей "головы" нет во всём тексте (один проход regex), по строкам не разбираем:
+    # совпадение в строке — это и совпадение в тексте.
+    lines: Optional[list[str]] = None
+    for head_pat, from_line_start in _GS1_HEADS:
+        if not head_pat.search(text):
+            continue
+        if lines is None:
+            lines = [ln.strip() for ln in text.splitlines() if ln.strip()]
+        code = _code_after_head(lines, head_pat, head_from_line_start=from_line_start)
+        if code:
+            return code
 
     return None
 
 
+@contextmanager
+def _mapped(path: Path):
+    """
+    Файл, отображённый в память только на чтение. mmap — file-like (read/seek/tell),
+    его можно отдать PdfReader без копирования файла в память процесса.
+    """
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        yield mm
+
+
+def iter_pdf_pages(file_path: str | Path) -> Iterator[str]:
+    """
+    Текст страниц по одной (через PDFium), пустые пропускаем.
+    Документ открыт, пока генератор не исчерпан или не закрыт.
+    """
+    with _pdfium_document(str(file_path)) as doc:
+        for i in range(_pdfium_page_count(doc)):
+            # PDFium разделяет строки через \r\n
+            t = _page_text(doc, i).replace("\r\n", "\n").strip()
+            if t:
+                yield t
+
+
 def read_pdf(file_path: str | Path) -> str:
+    """
+    Весь текст PDF (страницы через перевод строки) — через PDFium, как и коды страниц.
+    Раскладка pdfplumber для поиска по артикулу/размеру не нужна.
+    """
     path = Path(file_path)
-    parts: list[str] = []
-    try:
-        with pdfplumber.open(str(path)) as pdf:
-            for p in pdf.pages:
-                t = p.extract_text()
-                if t:
-                    parts.append(t.strip())
-    except FileNotFoundError:
+    if not path.exists():
         print(f"[read_pdf] not found: {path}")
         return ""
+    try:
+        return "\n".join(iter_pdf_pages(path))
     except Exception as e:
         print(f"[read_pdf] failed {path}: {e}")
         return ""
-    return "\n".join(parts)
 
 
 # ---- поиск PDF по (артикул, размер)
+_RE_SIZE_LETTERS = re.compile(r"[2-5]?(?:XS|S|M|L|XL|XXL|XXXL)")
+_RE_SIZE_SEP = re.compile(r"[-/]")
+
+
+def _normalize_size(size_raw: str) -> str:
+    s = str(size_raw).translate(_WS_DELETE).upper()
+    return normalize_dashes(s)
+
+
+@functools.lru_cache(maxsize=256)
 def _compile_size_token(size_raw: str) -> re.Pattern:
     """
     Жёсткое совпадение конкретного значения размера пользователя (а не любого).
@@ -239,26 +476,65 @@ def _compile_size_token(size_raw: str) -> re.Pattern:
     - допускаем '-', '–', '/', между числами
     - границы токена (не буквы/цифры слева/справа)
     """
-    s = re.sub(r"\s+", "", str(size_raw)).upper()
-    s = s.replace("–", "-").replace("—", "-")
-    if re.fullmatch(r"[2-5]?(?:XS|S|M|L|XL|XXL|XXXL)", s):
+    s = _normalize_size(size_raw)
+    if _RE_SIZE_LETTERS.fullmatch(s):
         return re.compile(rf"(?<![A-Z0-9]){re.escape(s)}(?![A-Z0-9])", re.IGNORECASE | re.MULTILINE)
     token = re.escape(s).replace(r"\-", r"[–\-\/]")
     return re.compile(rf"(?<!\w){token}(?!\w)", re.IGNORECASE | re.MULTILINE)
 
-def find_pdfs_by_article_size_all(article: str, size: str) -> list[Path]:
+def _size_needle(size_raw: str) -> str:
+    """
+    Литерал для предпроверки размера до regex: часть до первого '-' или '/'
+    (между частями диапазона в тексте может стоять любое из тире или '/').
+    """
+    return _RE_SIZE_SEP.split(_normalize_size(size_raw), maxsplit=1)[0]
+
+def _has_size_label(text_upper: str, label: str) -> bool:
+    """
+    Быстрый литеральный путь: "РАЗМЕР: <размер>" целым токеном (следом не буква/цифра).
+    Попадание гарантирует и совпадение _compile_size_token; промах — ещё не отказ.
+    """
+    i = text_upper.find(label)
+    while i != -1:
+        j = i + len(label)
+        if j == len(text_upper) or not (text_upper[j].isalnum() or text_upper[j] == "_"):
+            return True
+        i = text_upper.find(label, i + 1)
+    return False
+
+def list_source_pdfs() -> list[Path]:
+    """
+    PDF-исходники (PDF_DIR, без подпапок) одним проходом os.scandir.
+    Сборка снимает список один раз и отдаёт его в каждый поиск.
+    """
+    out: list[Path] = []
+    try:
+        with os.scandir(PDF_DIR) as it:
+            for e in it:
+                if e.name.endswith(".pdf") and e.is_file():
+                    out.append(Path(e.path))
+    except OSError:
+        pass
+    return out
+
+
+def find_pdfs_by_article_size_all(
+    article: str,
+    size: str,
+    pdf_files: Optional[list[Path]] = None,
+) -> list[Path]:
     """
     1) FAST: поиск по имени (в OUT_DIR и PDF_DIR)
     2) если article в df обрезан — ищем по префиксу (до '/')
     3) размер-число/диапазон — матчим как префикс (158*, 140-146*, 50*)
     4) FALLBACK: старый медленный поиск по тексту
+    pdf_files — готовый список исходников (list_source_pdfs); без него читаем папку сами.
     """
     if not article or not size:
         return []
 
-    # где лежат нарезанные файлы
-    search_dirs = []
-    search_dirs.append(PDF_DIR)       # на всякий случай
+    if pdf_files is None:
+        pdf_files = list_source_pdfs()
 
     size_raw = _norm_size_for_fname(size)
     size_s = _safe_name(size_raw)
@@ -270,20 +546,12 @@ def find_pdfs_by_article_size_all(article: str, size: str) -> list[Path]:
     art_prefix_s = _safe_name(art_prefix)
 
     def _glob_all(patterns: list[str]) -> list[Path]:
-        acc: set[Path] = set()
-
-        for d in search_dirs:
-            for pattern in patterns:
-                try:
-                    for p in d.glob(pattern):
-                        acc.add(p)
-                except Exception:
-                    continue
-
+        # имена уже прошли _safe_name — спецсимволов glob в шаблонах нет
+        acc = {p for p in pdf_files if any(fnmatchcase(p.name, pat) for pat in patterns)}
         return sorted(acc, key=lambda p: p.name.lower())
 
     # если размер начинается с цифры (50, 158, 140-146, 152-158 и т.д.) — разрешаем хвост типа "_РОСТ"
-    size_prefixable = bool(re.match(r"^\d", size_raw))
+    size_prefixable = bool(_RE_LEADING_DIGIT.match(size_raw))
 
     # ---------- FAST 1: полное совпадение по статье
     article_base, color = article.split("/", 1) if "/" in article else (article, "")
@@ -318,15 +586,13 @@ def find_pdfs_by_article_size_all(article: str, size: str) -> list[Path]:
     color = color.lower()
     art_prefix_s = _safe_name(art_prefix)
 
-    a_no_ws = _strip_all_ws(art_prefix)
+    a_no_ws = _article_no_ws(art_prefix)
     size_regex = _compile_size_token(size)
+    size_needle = _size_needle(size)
+    size_label = f"РАЗМЕР: {_normalize_size(size)}"
 
-    all_pdfs: list[Path] = []
-    for d in search_dirs:
-        try:
-            all_pdfs.extend(d.glob(f"{art_prefix_s}*.pdf"))
-        except Exception:
-            pass
+    prefix_pat = f"{art_prefix_s}*.pdf"
+    all_pdfs = [p for p in pdf_files if fnmatchcase(p.name, prefix_pat)]
     print(all_pdfs)
 
     for i, pdf_file in enumerate(all_pdfs):
@@ -335,35 +601,133 @@ def find_pdfs_by_article_size_all(article: str, size: str) -> list[Path]:
             continue
         # print(f"[Check file {i} of {len(all_pdfs)}]")
         try:
-            raw_text = get_pdf_text_cached(pdf_file)
+            pdf_text = get_pdf_text_cached(pdf_file)
         except Exception:
             continue
 
-        raw_text_norm = raw_text.replace("–", "-").replace("—", "-")
-
-        if a_no_ws not in _strip_all_ws(raw_text):
+        if a_no_ws not in pdf_text.flat:
             continue
 
+        raw_text = pdf_text.raw
+
         if color and color not in raw_text.lower():
             continue
 
-        if size_regex.search(raw_text_norm):
+        # в большинстве файлов размера нет вовсе — отсекаем их без regex
+        if size_needle not in pdf_text.upper:
+            continue
+
+        # обычно в тексте WB ровно "Размер: <размер>" — regex нужен только при промахе
+        if _has_size_label(pdf_text.upper, size_label) or size_regex.search(
+            normalize_dashes(raw_text)
+        ):
             results.append(pdf_file)
 
     results.sort(key=lambda p: p.name.lower())
     return results
 
 
-def _build_tail_writer(reader: PdfReader, total: int, keep_indexes: set[int]) -> PdfWriter:
+def _build_tail_writer(reader: PdfReader, keep_indexes_sorted: list[int]) -> PdfWriter:
+    """Страницы keep_indexes_sorted (по возрастанию) — удалённые даже не перебираем."""
     w = PdfWriter()
-    for i in range(total):
-        if i in keep_indexes:
-            w.add_page(reader.pages[i])
+    for i in keep_indexes_sorted:
+        w.add_page(reader.pages[i])
     return w
 
-def _extract_page_code(pl_pdf, page_index: int) -> Optional[str]:
-    txt = pl_pdf.pages[page_index].extract_text(x_tolerance=1.0, y_tolerance=1.0) or ""
-    return _extract_code_from_text(txt)
+# судьба страницы исходника при нарезке (байт на страницу в bytearray)
+_PAGE_KEEP = 0  # остаётся в исходнике (tail)
+_PAGE_HEAD = 1  # уходит в head
+_PAGE_DROP = 2  # дубль — выбрасываем
+
+
+def _split_head_tail(reader: PdfReader, page_state: bytearray) -> Tuple[PdfWriter, PdfWriter]:
+    """Один проход по страницам: взятые -> head, не тронутые -> tail, дубли отбрасываем."""
+    head, tail = PdfWriter(), PdfWriter()
+    for i, state in enumerate(page_state):
+        if state == _PAGE_HEAD:
+            head.add_page(reader.pages[i])
+        elif state == _PAGE_KEEP:
+            tail.add_page(reader.pages[i])
+    return head, tail
+
+
+def _split_source(data: bytes, page_state: bytearray) -> Tuple[PdfWriter, PdfWriter]:
+    """
+    Разбор исходника PyPDF2 + раскладка страниц по head/tail — одним заходом в поток:
+    клонирование страниц в writer тоже CPU-работа, ей не место в event loop.
+    """
+    reader = PdfReader(io.BytesIO(data))
+    if len(reader.pages) != len(page_state):
+        raise ValueError("page count mismatch between PDFium and PyPDF2")
+    return _split_head_tail(reader, page_state)
+
+def _pdfium_open(src):
+    """PDF через PDFium (src — путь, bytes или file-like); открываем под общим локом."""
+    with _pdfium_lock:
+        return pdfium.PdfDocument(src)
+
+
+def _pdfium_close(doc) -> None:
+    with _pdfium_lock:
+        doc.close()
+
+
+def _pdfium_open_counted(src):
+    """(документ, число страниц) — для открытия из потока одним вызовом."""
+    doc = _pdfium_open(src)
+    try:
+        return doc, _pdfium_page_count(doc)
+    except BaseException:
+        _pdfium_close(doc)
+        raise
+
+
+@contextmanager
+def _pdfium_document(src):
+    """PDF через PDFium для синхронного кода; закрываем под тем же локом."""
+    doc = _pdfium_open(src)
+    try:
+        yield doc
+    finally:
+        _pdfium_close(doc)
+
+
+def _pdfium_page_count(doc) -> int:
+    with _pdfium_lock:
+        return len(doc)
+
+
+def _page_text(doc, page_index: int) -> str:
+    """
+    Линейный текст страницы. Нам не нужна раскладка pdfplumber (chars/rects/кластеризация):
+    _extract_code_from_text работает с обычной строкой, а PDFium достаёт её в C++.
+    """
+    with _pdfium_lock:
+        page = doc[page_index]
+        try:
+            textpage = page.get_textpage()
+            try:
+                # страница без текстового слоя (картинка) — текст не собираем
+                if textpage.count_chars() <= 0:
+                    return ""
+                # get_text_range() без аргументов в pypdfium2 4.x предупреждает
+                # и сам уходит в get_text_bounded() — зовём его напрямую
+                return textpage.get_text_bounded() or ""
+            finally:
+                textpage.close()
+        finally:
+            page.close()
+
+def _extract_page_code(doc, page_index: int) -> Optional[str]:
+    return _extract_code_from_text(_page_text(doc, page_index))
+
+
+def _extract_codes_range(doc, start: int, stop: int) -> list[Optional[str]]:
+    """
+    Коды страниц [start, stop) — тем же _extract_page_code, что и возврат/чистка:
+    код, записанный в printed_codes при нарезке, должен совпасть с кодом при возврате.
+    """
+    return [_extract_page_code(doc, i) for i in range(start, stop)]
 
 async def cut_first_n_pages_unique_checkonly(
     src_pdf: Path | str,
@@ -374,7 +738,7 @@ async def cut_first_n_pages_unique_checkonly(
     """
     CHANGED:
     - НЕ читаем все тексты страниц сразу
-    - идём по страницам до набора n
+    - идём по страницам пачками (текст — в потоке, через PDFium) до набора n
     - уникальность через claim_code(... staged_codes_global ...)
     - после модификации src инвалидируем кеш текста (важно для find)
     """
@@ -385,93 +749,118 @@ async def cut_first_n_pages_unique_checkonly(
     tmp_dir = src.parent / "tmp"
     tmp_dir.mkdir(parents=True, exist_ok=True)
 
+    # файл читаем с диска один раз: и PDFium, и (если дойдёт до записи) PdfReader
+    # работают с одним буфером
     try:
-        reader = await _to_thread(PdfReader, str(src))
+        data = await _to_thread(src.read_bytes)
     except Exception:
         return None, n, []
 
-    total_pages = len(reader.pages)
-    to_delete: set[int] = set()
-    head_writer = PdfWriter()
+    total_pages = 0
+    page_state = bytearray()
+    dropped = 0
     unique_taken = 0
     picked_codes: list[str] = []
 
-    # CHANGED: открываем pdfplumber один раз и идём по страницам
+    # текст страниц извлекаем пачками в потоке, а коды "бронируем"
+    # последовательно в порядке страниц (важно для уникальности)
+    # лок PDFium может держать другой поток — открываем/закрываем документ тоже в потоке,
+    # чтобы не блокировать event loop
+    doc = None
     try:
-        with pdfplumber.open(str(src)) as pl:
-            for i in range(total_pages):
+        doc, total_pages = await _to_thread(_pdfium_open_counted, data)
+        page_state = bytearray(total_pages)  # все _PAGE_KEEP
+        start = 0
+        while start < total_pages and unique_taken < n:
+            # пачка не больше, чем ещё нужно кодов: лишние страницы не разбираем
+            batch = min(_PAGE_BATCH, max(n - unique_taken, _MIN_PAGE_BATCH))
+            stop = min(total_pages, start + batch)
+            codes = await _to_thread(_extract_codes_range, doc, start, stop)
+
+            for i, code in enumerate(codes, start=start):
                 if unique_taken >= n:
                     break
-
-                txt = pl.pages[i].extract_text(x_tolerance=1.0, y_tolerance=1.0) or ""
-                code = _extract_code_from_text(txt)
                 if not code:
                     continue
 
                 ok = await claim_code(code, used_codes, staged_codes_global)
                 if not ok:
                     # код уже был выдан ранее (или уже взят другой строкой)
-                    to_delete.add(i)
+                    page_state[i] = _PAGE_DROP
+                    dropped += 1
                     continue
 
                 picked_codes.append(code)
-                head_writer.add_page(reader.pages[i])
-                to_delete.add(i)
+                page_state[i] = _PAGE_HEAD
                 unique_taken += 1
+
+            start = stop
     except Exception:
         return None, n, []
+    finally:
+        if doc is not None:
+            await _to_thread(_pdfium_close, doc)
 
-    # если ничего не взяли — но могли удалить дубли
-    if unique_taken == 0:
-        if to_delete:
-            keep = set(range(total_pages)) - to_delete
-            tail_writer = _build_tail_writer(reader, total_pages, keep)
-            if len(tail_writer.pages) > 0:
-                tail_tmp = tmp_dir / f"{src.stem}__tail_tmp.pdf"
-                await _to_thread(_write_pdf, tail_writer, tail_tmp)
-                await _to_thread(_replace_file, tail_tmp, src)
-                invalidate_pdf_cache(src)  # NEW
-            else:
-                try:
-                    await _to_thread(src.unlink, True)
-                except Exception:
-                    pass
-                invalidate_pdf_cache(src)  # NEW
+    # ничего не взяли и ничего не удалили — исходник не трогаем
+    if unique_taken == 0 and dropped == 0:
         return None, n, []
 
     head_out = tmp_dir / f"{src.stem}__head_{unique_taken}.pdf"
-    await _to_thread(_write_pdf, head_writer, head_out)
-
-    keep = set(range(total_pages)) - to_delete
-    if keep:
-        tail_writer = _build_tail_writer(reader, total_pages, keep)
-        tail_tmp = tmp_dir / f"{src.stem}__tail_tmp.pdf"
-        await _to_thread(_write_pdf, tail_writer, tail_tmp)
-        await _to_thread(_replace_file, tail_tmp, src)
-        invalidate_pdf_cache(src)  # NEW
-    else:
+
+    # забрали весь файл целиком (без дублей) — head совпадает с исходником,
+    # пересобирать страницы не нужно, просто переносим файл
+    if unique_taken == total_pages:
+        await _to_thread(_replace_file, src, head_out)
+        invalidate_pdf_cache(src)
+        return head_out, max(0, n - unique_taken), picked_codes
+
+    # PyPDF2 разбирает файл только здесь — когда действительно нужно писать страницы;
+    # head и tail собираем за один проход по страницам
+    try:
+        head_writer, tail_writer = await _to_thread(_split_source, data, page_state)
+    except Exception as e:
+        print(f"[cut] {src.name}: can't rewrite ({e})")
+        # страницы не вырезали — снимаем бронь с кодов, чтобы их могла взять другая строка
+        staged_codes_global.difference_update(picked_codes)
+        return None, n, []
+
+    # сначала head, и только после его успешной записи — tail поверх исходника:
+    # иначе при сбое записи head взятые страницы не остались бы ни в одном файле
+    if unique_taken > 0:
+        await _to_thread(_write_pdf, head_writer, head_out)
+    # tail заменяет исходник атомарно (_write_pdf пишет через tmp + os.replace);
+    # исходник уже прочитан в память, так что перезаписывать его безопасно
+    has_tail = len(tail_writer.pages) > 0
+    if has_tail:
+        await _to_thread(_write_pdf, tail_writer, src)
+
+    if not has_tail:
         try:
             await _to_thread(src.unlink, True)
         except Exception:
             pass
-        invalidate_pdf_cache(src)  # NEW
+    invalidate_pdf_cache(src)  # NEW
 
+    if unique_taken == 0:
+        # взять ничего не удалось, но дубли из исходника убрали
+        return None, n, []
     return head_out, max(0, n - unique_taken), picked_codes
 
 
 def merge_pdfs(pdf_paths: list[Path | str], output_path: Path | str) -> Path:
     writer = PdfWriter()
-    for p in pdf_paths:
-        pth = Path(p)
-        if not pth.exists():
-            continue
-        reader = PdfReader(str(pth))
-        for page in reader.pages:
-            writer.add_page(page)
     out = Path(output_path)
     out.parent.mkdir(parents=True, exist_ok=True)
-    with open(out, "wb") as f:
-        writer.write(f)
+    # части читаются лениво при записи — держим отображения открытыми до конца
+    with ExitStack() as stack:
+        for p in pdf_paths:
+            pth = Path(p)
+            if not pth.exists():
+                continue
+            reader = PdfReader(stack.enter_context(_mapped(pth)))
+            writer.append_pages_from_reader(reader)
+        with open(out, "wb", buffering=_WRITE_BUFFER) as f:
+            writer.write(f)
     return out
 
 def _normalize_columns(df) -> tuple[int, int, int]:
@@ -488,14 +877,36 @@ def _append_shortage(shortages: list[str], article: str, size: str, amount: int)
 
 
 
+def _find_pdfs_shared(
+    article: str,
+    size: str,
+    pdf_index: dict[tuple[str, str], "asyncio.Future[list[Path]]"],
+    pdf_files: Optional[list[Path]] = None,
+) -> "asyncio.Future[list[Path]]":
+    """
+    Поиск PDF по (артикул, размер) — один раз на сборку.
+    Строки с тем же ключом (в т.ч. идущие параллельно) ждут тот же поиск.
+    Урезание файлов набор кандидатов не меняет: остаток лежит под тем же именем,
+    а удалённые файлы cut_first_n_pages_unique_checkonly просто пропускает.
+    """
+    key = (article, size)
+    fut = pdf_index.get(key)
+    if fut is None:
+        fut = pdf_index[key] = asyncio.ensure_future(
+            _to_thread(find_pdfs_by_article_size_all, article, size, pdf_files)
+        )
+    return fut
+
+
 async def _process_order_row(
     row_no: int,
-    row,
-    idx_article: int,
-    idx_size: int,
-    idx_qty: int,
+    article: str,
+    size: str,
+    qty: int,
     used_codes: set[str],
     staged_codes_global: set[str],  # CHANGED
+    pdf_index: Optional[dict[tuple[str, str], "asyncio.Future[list[Path]]"]] = None,
+    pdf_files: Optional[list[Path]] = None,
 ) -> tuple[int, list[Path], set[str], list[str]]:
     """
     CHANGED:
@@ -507,19 +918,14 @@ async def _process_order_row(
     staged_local: set[str] = set()     # оставим пустым/для совместимости
     shortages_local: list[str] = []
 
-    article = str(row.iloc[idx_article]).strip()
-    size    = str(row.iloc[idx_size]).strip()
-
-    try:
-        qty = int(row.iloc[idx_qty])
-    except Exception:
-        return row_no, parts, staged_local, shortages_local
-
     if qty <= 0:
         return row_no, parts, staged_local, shortages_local
 
     try:
-        pdf_paths = await _to_thread(find_pdfs_by_article_size_all, article, size)
+        if pdf_index is None:
+            pdf_paths = await _to_thread(find_pdfs_by_article_size_all, article, size, pdf_files)
+        else:
+            pdf_paths = list(await _find_pdfs_shared(article, size, pdf_index, pdf_files))
     except Exception:
         pdf_paths = []
 
@@ -536,7 +942,7 @@ async def _process_order_row(
             break
 
         src_pdf_path = Path(src_pdf_path)
-        lock = await get_pdf_lock(src_pdf_path)  # NEW
+        lock = get_pdf_lock(src_pdf_path)  # NEW
 
         async with lock:
             print(f"Check {src_pdf_path}")
@@ -550,18 +956,10 @@ async def _process_order_row(
 
         took_now = max(0, remaining - shortage)
 
+        # part_path != None означает, что в head попала хотя бы одна страница —
+        # повторно разбирать файл ради проверки не нужно
         if took_now > 0 and part_path is not None:
-            try:
-                rr = await _to_thread(PdfReader, str(part_path))
-                if len(rr.pages) > 0:
-                    parts.append(Path(part_path))
-                else:
-                    try:
-                        await _to_thread(Path(part_path).unlink, True)
-                    except Exception:
-                        pass
-            except Exception:
-                pass
+            parts.append(Path(part_path))
 
         remaining -= took_now
 
@@ -586,7 +984,18 @@ async def build_pdf_from_dataframe(
     PARALLELISM = 8
     sem = asyncio.Semaphore(PARALLELISM)
 
-    rows = list(df.iterrows())
+    # колонки приводим к нужным типам один раз, без iterrows()
+    articles = df.iloc[:, idx_article].astype(str).str.strip().tolist()
+    sizes = df.iloc[:, idx_size].astype(str).str.strip().tolist()
+    # количество — тем же parse_qty, что и в журнале заказов; нечисловое -> None
+    qtys = [parse_qty(v) for v in df.iloc[:, idx_qty].tolist()]
+
+    # строки без количества ничего не дают (ни частей, ни нехватки) — задачи под них не создаём
+    rows = [
+        (i, a, s, q)
+        for i, (a, s, q) in enumerate(zip(articles, sizes, qtys))
+        if q is not None and q > 0
+    ]
     total = len(rows)
 
     done = 0
@@ -604,12 +1013,17 @@ async def build_pdf_from_dataframe(
 
     # NEW: глобальные коды на время сборки
     staged_codes_global: set[str] = set()
+    # NEW: результаты поиска PDF по (артикул, размер) на время сборки
+    pdf_index: dict[tuple[str, str], asyncio.Future] = {}
+    # NEW: список исходников читаем один раз. Новые файлы в PDF_DIR за сборку не появляются
+    # (части пишутся в tmp/), а исчезнувшие поиск и нарезка и так пропускают
+    pdf_files = await _to_thread(list_source_pdfs)
 
     async with config.AsyncSessionLocal() as session:
         async with session.begin():
             used_codes = await get_all_codes(session)
 
-            async def _run_one(row_no: int, row_obj):
+            async def _run_one(row_no: int, article: str, size: str, qty: int):
                 nonlocal inflight, done
 
                 async with sem:
@@ -620,12 +1034,13 @@ async def build_pdf_from_dataframe(
                     try:
                         return await _process_order_row(
                             row_no=row_no,
-                            row=row_obj,
-                            idx_article=idx_article,
-                            idx_size=idx_size,
-                            idx_qty=idx_qty,
+                            article=article,
+                            size=size,
+                            qty=qty,
                             used_codes=used_codes,
                             staged_codes_global=staged_codes_global,  # CHANGED
+                            pdf_index=pdf_index,
+                            pdf_files=pdf_files,
                         )
                     finally:
                         async with lock:
@@ -633,7 +1048,7 @@ async def build_pdf_from_dataframe(
                             done += 1
                             print(f"[{done}/{total}] DONE   inflight={inflight}  {_fmt_eta(done)}")
 
-            tasks = [_run_one(i, row) for i, (_, row) in enumerate(rows)]
+            tasks = [_run_one(*row) for row in rows]
             results = await asyncio.gather(*tasks)
             results.sort(key=lambda x: x[0])
 
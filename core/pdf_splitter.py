@@ -1,31 +1,49 @@
 from pathlib import Path
 from typing import Optional, Tuple, Dict, List
 import re
-import os
+import sys
+import asyncio
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
 
-import pdfplumber
 from PyPDF2 import PdfReader, PdfWriter
 from .patterns import *
 from datetime import datetime
-from .text_clean import clean_for_parsing, strip_gs1, normalize_dashes, clean_color_value
-from .pdf_rw import _extract_article_fallback, _safe_name, _extract_color_fallback
+from .text_clean import collapse_repeats, clean_for_parsing, strip_gs1, normalize_dashes, clean_color_value
+from .pdf_rw import (
+    _extract_article_fallback, _safe_name, _extract_color_fallback,
+    _pdfium_document, _pdfium_page_count, _page_text, _write_pdf,
+)
 
 # PDF_DIR = Path("pdf-codes")
 OUT_DIR = PDF_DIR
 OUT_DIR.mkdir(parents=True, exist_ok=True)
 
+# регулярки парсинга страницы — компилируем один раз
+_RE_TRAIL_DASH = re.compile(r"[-–—]+$")
+_RE_ART_LABEL_LINE = re.compile(r"артикул[:.]?", re.IGNORECASE)
+_RE_DASHES = re.compile(r"[–—]")
+_RE_SEP_WS = re.compile(r"\s*([\-\/])\s*")
+_RE_WS = re.compile(r"\s+")
+_RE_LATIN = re.compile(r"[A-Za-z]")
+
+_RE_UNGLUE_ART = re.compile(r"(?<!^)(Артикул)(?=\S)", re.IGNORECASE)
+_RE_UNGLUE_COLOR = re.compile(r"(?<!^)(Цвет\s*:)(?=\S)", re.IGNORECASE)
+_RE_UNGLUE_SIZE = re.compile(r"(?<!^)(Размер\s*:)(?=\S)", re.IGNORECASE)
+
+_RE_SLASH_NL = re.compile(r"/\s*\n\s*")
+_RE_WORD_HYPHEN_NL = re.compile(r"([A-Za-zА-Яа-яЁё])-\s*\n\s*([A-Za-zА-Яа-яЁё])")
+_RE_WORD_NL = re.compile(r"([A-Za-zА-Яа-яЁё])\s*\n\s*([A-Za-zА-Яа-яЁё])")
+_RE_SPACES = re.compile(r"[ \t]+")
+
 def _cleanup_article(s: str) -> str:
     # отрезаем всё после "Цвет", убираем двоеточие/хвостовой дефис и дубли
     s = RE_COLOR_TOKEN.split(s, maxsplit=1)[0]
     s = s.rstrip(":").strip()
     # убрать висящий дефис в конце (после склейки переносов)
-    s = re.sub(r"[-–—]+$", "", s).strip()
+    s = _RE_TRAIL_DASH.sub("", s).strip()
     # схлопнуть «XX» → «X» если внезапно склеилось дважды
-    while True:
-        m = re.fullmatch(r"(.+?)\1+", s)
-        if not m: break
-        s = m.group(1)
-    return s
+    return collapse_repeats(s)
 
 def _extract_article(text: str) -> Optional[str]:
     # 1) обычный «Артикул ...»
@@ -41,7 +59,7 @@ def _extract_article(text: str) -> Optional[str]:
     # 3) fallback: «Артикул» на СВОЕЙ строке, значение — на следующей
     lines = [ln.strip() for ln in (text or "").splitlines()]
     for i, ln in enumerate(lines):
-        if re.fullmatch(r"артикул[:.]?", ln, flags=re.IGNORECASE):
+        if _RE_ART_LABEL_LINE.fullmatch(ln):
             if i + 1 < len(lines) and lines[i+1]:
                 return _cleanup_article(lines[i+1].strip())
 
@@ -54,30 +72,30 @@ def _extract_article(text: str) -> Optional[str]:
 
 def _clean_size(s: str) -> str:
     s = (s or "").strip()
-    s = re.sub(r"[–—]", "-", s)              # нормализуем тире
-    s = re.sub(r"\s*([\-\/])\s*", r"\1", s)  # пробелы вокруг - и /
-    s = re.sub(r"\s+", " ", s).strip()
+    s = _RE_DASHES.sub("-", s)          # нормализуем тире
+    s = _RE_SEP_WS.sub(r"\1", s)        # пробелы вокруг - и /
+    s = _RE_WS.sub(" ", s).strip()
     return s.split(" ", 1)[0] if s else ""
 
 
 def _unglue_labels(t: str) -> str:
     # вставляем разделитель перед метками, если они прилипли
     # пример: "...мужскойАртикулLT..." -> "...мужской\nАртикул LT..."
-    t = re.sub(r"(?<!^)(Артикул)(?=\S)", r"\n\1 ", t, flags=re.IGNORECASE)
-    t = re.sub(r"(?<!^)(Цвет\s*:)(?=\S)",   r"\n\1 ", t, flags=re.IGNORECASE)
-    t = re.sub(r"(?<!^)(Размер\s*:)(?=\S)", r"\n\1 ", t, flags=re.IGNORECASE)
+    t = _RE_UNGLUE_ART.sub(r"\n\1 ", t)
+    t = _RE_UNGLUE_COLOR.sub(r"\n\1 ", t)
+    t = _RE_UNGLUE_SIZE.sub(r"\n\1 ", t)
     return t
 
 def _heal_linebreaks(raw: str) -> str:
     t = raw or ""
     # '/\n' -> '/'
-    t = re.sub(r"/\s*\n\s*", "/", t)
+    t = _RE_SLASH_NL.sub("/", t)
     # перенос с дефисом внутри слова: 'сло-\nво' -> 'слово'
-    t = re.sub(r"([A-Za-zА-Яа-яЁё])-\s*\n\s*([A-Za-zА-Яа-яЁё])", r"\1\2", t)
+    t = _RE_WORD_HYPHEN_NL.sub(r"\1\2", t)
     # обычный перенос внутри слова: 'сло\nво' -> 'слово'
-    t = re.sub(r"([A-Za-zА-Яа-яЁё])\s*\n\s*([A-Za-zА-Яа-яЁё])", r"\1\2", t)
+    t = _RE_WORD_NL.sub(r"\1\2", t)
     # если дефис-цвет оказался один на отдельной строке после склейки — оставим как есть
-    t = re.sub(r"[ \t]+", " ", t)
+    t = _RE_SPACES.sub(" ", t)
     t = _unglue_labels(t)
     return t
 
@@ -85,31 +103,45 @@ def _heal_linebreaks(raw: str) -> str:
 
 
 
-def _extract_size_from_text(text: str) -> Optional[str]:
-    # вырезаем GS1-блоки, чтобы сериал не мешал распознаванию размера
-    text = re.sub(r"\(01\)\s*\d{14}", " ", text)
-    text = re.sub(r"\(21\)\s*[!-~]{4,}", " ", text)
+# NEW: «Размер:», буквенный и числовой размер — одним проходом по тексту.
+# Приоритет прежний: метка где угодно > первая буквенная > первая числовая.
+_RE_SIZE_ANY = re.compile(
+    rf"(?P<label>{RE_SIZE_LABEL.pattern})"
+    rf"|(?P<alpha>{RE_SIZE_ALPHA.pattern})"
+    rf"|(?P<num>{RE_SIZE_NUMERIC.pattern})",
+    re.IGNORECASE | re.VERBOSE,
+)
 
-    # 1) Явная метка "Размер:"
-    m = re.search(r"Размер:\s*([^\r\n]+)", text, re.IGNORECASE)
-    if m:
-        return _clean_size(m.group(1))
 
-    # 2) Буквенные комбинации
-    m = RE_SIZE_ALPHA.search(text)
-    if m:
-        return _clean_size(m.group(0).upper())
+def _search_size(text: str) -> Optional[str]:
+    """Сырой размер по правилам «метка → буквенный → числовой» (без SIZE_WORDS)."""
+    alpha = num = None
+    for m in _RE_SIZE_ANY.finditer(text):
+        kind = m.lastgroup
+        if kind == "label":
+            return m.group(2)
+        if kind == "alpha":
+            if alpha is None:
+                alpha = m.group(0).upper()
+        elif num is None:
+            num = m.group(0)
+    return alpha or num
 
-    # 3) Числовые варианты
-    m = RE_SIZE_NUMERIC.search(text)
-    if m:
-        return _clean_size(m.group(0))
+
+def _extract_size_from_text(text: str) -> Optional[str]:
+    # вырезаем GS1-блоки, чтобы сериал не мешал распознаванию размера
+    text = strip_gs1(text)
+
+    # 1-3) Метка "Размер:", буквенные комбинации, числовые варианты
+    s = _search_size(text)
+    if s:
+        return _clean_size(s)
 
     # 4) Словесные
     for m in RE_SIZE_WORD.finditer(text):
         cand = _clean_size(m.group(0))
-        if cand.upper() in {w.upper() for w in SIZE_WORDS}:
-            return cand.upper() if re.search(r"[A-Za-z]", cand) else cand
+        if cand.upper() in SIZE_WORDS_UPPER:
+            return cand.upper() if _RE_LATIN.search(cand) else cand
 
     return None
 
@@ -120,22 +152,29 @@ async def _save_temp_pdf(data: bytes, filename: str, user_id: int) -> Path:
     tmp_dir = PDF_DIR / "tmp"
     tmp_dir.mkdir(parents=True, exist_ok=True)
     tmp_path = tmp_dir / f"{user_id}_{filename}"
-    with open(tmp_path, "wb") as f:
-        f.write(data)
+    # запись многомегабайтного PDF не должна блокировать event loop
+    await asyncio.to_thread(tmp_path.write_bytes, data)
     return tmp_path
 
 
 
 
 
-def _extract_page_meta(pl_page) -> Tuple[Optional[str], Optional[str], Optional[str]]:
-    raw = pl_page.extract_text(x_tolerance=1.0, y_tolerance=1.0) or ""
+def _extract_page_meta(raw: str) -> Tuple[Optional[str], Optional[str], Optional[str]]:
+    """
+    (Артикул, Размер, Цвет) из текста страницы; raw — текст от PDFium.
+    Страница без полного ключа в split_pdf_by_meta всё равно пропускается,
+    поэтому без артикула/размера дальше не ищем (остальные поля будут None).
+    """
+    # страница без текстового слоя (скан/картинка) — весь regex-конвейер не нужен
+    if not raw or raw.isspace():
+        return None, None, None
+
     txt = clean_for_parsing(raw)
     txt = normalize_dashes(txt)
 
-    txt_wo_gs1 = strip_gs1(txt)
-
-    lines = [ln.strip() for ln in txt.splitlines() if ln.strip()]
+    # strip — один раз на строку (раньше и в фильтре, и в значении)
+    lines = [ln for ln in map(str.strip, txt.splitlines()) if ln]
     text  = "\n".join(lines)
 
     # ---- Артикул
@@ -146,30 +185,21 @@ def _extract_page_meta(pl_page) -> Tuple[Optional[str], Optional[str], Optional[
         art = _extract_article_fallback(text)
 
     if art:
-        while True:
-            mm = re.fullmatch(r"(.+?)\1+", art)
-            if not mm:
-                break
-            art = mm.group(1)
+        art = collapse_repeats(art)
 
     if m:
         val = RE_COLOR_TOKEN.split(m.group(1), maxsplit=1)[0]
         if not art:
-            art = re.sub(r"[-–—]+$", "", val).strip()
+            art = _RE_TRAIL_DASH.sub("", val).strip()
 
     else:
         for i, ln in enumerate(lines):
-            if re.fullmatch(r"артикул[:.]?", ln, flags=re.IGNORECASE):
+            if _RE_ART_LABEL_LINE.fullmatch(ln):
                 if i + 1 < len(lines):
                     val = RE_COLOR_TOKEN.split(lines[i+1], maxsplit=1)[0]
-                    art = re.sub(r"[-–—]+$", "", val).strip()
+                    art = _RE_TRAIL_DASH.sub("", val).strip()
                 break
-
-        if not art:
-            m = RE_ART_ALT2.search(text)
-            if m:
-                val = RE_COLOR_TOKEN.split(m.group(1), maxsplit=1)[0]
-                art = re.sub(r"[-–—]+$", "", val).strip()
+        # повторный RE_ART_ALT2.search(text) не нужен: он уже вернул None выше
 
     # ---- FALLBACK_PRODUCTS
     # print(art)
@@ -183,27 +213,18 @@ def _extract_page_meta(pl_page) -> Tuple[Optional[str], Optional[str], Optional[
     #             break
     #         art = mm.group(1)
 
-    # ---- Размер
-    size = None
-
-    m = RE_SIZE_LABEL.search(txt_wo_gs1)
-    if m:
-        size = m.group(1)
+    if not art:
+        return None, None, None
 
-    if not size:
-        m = RE_SIZE_ALPHA.search(txt_wo_gs1)
-        if m:
-            size = m.group(0).upper()
+    txt_wo_gs1 = strip_gs1(txt)
 
-    if not size:
-        m = RE_SIZE_NUMERIC.search(txt_wo_gs1)
-        if m:
-            size = m.group(0)
+    # ---- Размер
+    size = _search_size(txt_wo_gs1)
 
     if not size:
         for m in RE_SIZE_WORD.finditer(txt_wo_gs1):
             cand = m.group(0)
-            if cand.upper() in {w.upper() for w in SIZE_WORDS}:
+            if cand.upper() in SIZE_WORDS_UPPER:
                 size = cand
                 break
 
@@ -212,11 +233,14 @@ def _extract_page_meta(pl_page) -> Tuple[Optional[str], Optional[str], Optional[
         size = "ONESIZE"
 
     if size:
-        size = re.sub(r"[–—]", "-", size)
-        size = re.sub(r"\s*([\-\/])\s*", r"\1", size)
-        size = re.sub(r"\s+", " ", size).strip()
+        size = _RE_DASHES.sub("-", size)
+        size = _RE_SEP_WS.sub(r"\1", size)
+        size = _RE_WS.sub(" ", size).strip()
         size = size.split(" ", 1)[0]
 
+    if not size:
+        return sys.intern(art), None, None
+
     # ---- Цвет
     color = ""
 
@@ -241,7 +265,15 @@ def _extract_page_meta(pl_page) -> Tuple[Optional[str], Optional[str], Optional[
     if not color:
         color = _extract_color_fallback(lines)
 
-    return (art or None), (size or None), (color or None)
+    # одинаковые (art, size, color) повторяются почти на каждой странице —
+    # интернируем, чтобы ключи групп были одними и теми же объектами
+    return (
+        sys.intern(art) if art else None,
+        sys.intern(size) if size else None,
+        sys.intern(color) if color else None,
+    )
+
+_SPLIT_WRITE_WORKERS = 4
 
 def split_pdf_by_meta(src_pdf: Path | str) -> dict:
     """
@@ -261,33 +293,45 @@ def split_pdf_by_meta(src_pdf: Path | str) -> dict:
     reader = PdfReader(str(src))
     total = len(reader.pages)
 
-    groups: Dict[Tuple[str, str, str], PdfWriter] = {}
+    # CHANGED: сначала только раскладываем номера страниц по ключам,
+    # PdfWriter создаём по одному на группу уже при записи
+    buckets: Dict[Tuple[str, str, str], List[int]] = defaultdict(list)
     skipped_without_meta = 0
 
-    with pdfplumber.open(str(src)) as pl_pdf:
+    # CHANGED: текст страниц — через PDFium (как в нарезке и чистке), без раскладки pdfplumber
+    with _pdfium_document(str(src)) as doc:
+        if _pdfium_page_count(doc) != total:
+            raise ValueError("page count mismatch between PDFium and PyPDF2")
         for i in range(total):
-            art, size, color = _extract_page_meta(pl_pdf.pages[i])
+            # PDFium разделяет строки через \r\n
+            raw = _page_text(doc, i).replace("\r\n", "\n")
+            art, size, color = _extract_page_meta(raw)
             if not (art and size and color):
                 skipped_without_meta += 1
                 continue
 
-            key = (art, size, color)
-            if key not in groups:
-                groups[key] = PdfWriter()
-            groups[key].add_page(reader.pages[i])
+            buckets[(art, size, color)].append(i)
 
     outputs = []
-    for (art, size, color), writer in groups.items():
-        if len(writer.pages) == 0:
-            continue
-        ts = datetime.now().strftime("%Y%m%d-%H%M%S")
-        fname = f"{_safe_name(art)}__{_safe_name(size)}__{_safe_name(color)}__{len(writer.pages)}p_{ts}.pdf"
-        out_path = OUT_DIR / fname
-        tmp = OUT_DIR / (fname + ".__tmp")
-        with open(tmp, "wb") as f:
-            writer.write(f)
-        os.replace(tmp, out_path)
-        outputs.append({"path": out_path, "pages": len(writer.pages), "key": (art, size, color)})
+    # NEW: сериализация и запись групп — в пуле потоков, пока клонируем страницы следующей.
+    # add_page остаётся здесь (PyPDF2 читает общий поток reader'а); в полёте — не больше
+    # _SPLIT_WRITE_WORKERS групп, чтобы не держать в памяти графы объектов всех сразу
+    with ThreadPoolExecutor(max_workers=_SPLIT_WRITE_WORKERS) as ex:
+        in_flight = deque()
+        for (art, size, color), idxs in buckets.items():
+            writer = PdfWriter()
+            for i in idxs:
+                writer.add_page(reader.pages[i])
+            ts = datetime.now().strftime("%Y%m%d-%H%M%S")
+            fname = f"{_safe_name(art)}__{_safe_name(size)}__{_safe_name(color)}__{len(idxs)}p_{ts}.pdf"
+            out_path = OUT_DIR / fname
+            in_flight.append(ex.submit(_write_pdf, writer, out_path))
+            del writer
+            outputs.append({"path": out_path, "pages": len(idxs), "key": (art, size, color)})
+            if len(in_flight) >= _SPLIT_WRITE_WORKERS:
+                in_flight.popleft().result()
+        for fut in in_flight:
+            fut.result()
 
     return {
         "outputs": outputs,
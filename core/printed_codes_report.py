@@ -1,13 +1,54 @@
 # core/printed_codes_report.py
+import asyncio
+import hashlib
 from io import BytesIO
 from datetime import datetime
+from typing import Optional, Tuple
 
-import pandas as pd
+import xlsxwriter
 from sqlalchemy import text
 
 from config import config
 from services.printed_codes import get_all_codes
 
+# NEW: последний собранный отчёт — (отпечаток набора кодов, байты xlsx).
+# Если таблица не менялась между запросами, Excel заново не собираем.
+_REPORT_CACHE: Optional[Tuple[str, bytes]] = None
+
+
+def _codes_fingerprint(codes_sorted: list[str]) -> str:
+    h = hashlib.blake2b(digest_size=16)
+    h.update(str(len(codes_sorted)).encode())
+    for c in codes_sorted:
+        h.update(c.encode())
+        h.update(b"\n")
+    return h.hexdigest()
+
+
+def _build_excel_sync(codes: set[str]) -> bytes:
+    """Синхронная часть: сортировка, отпечаток и сборка xlsx (выполняется в потоке)."""
+    global _REPORT_CACHE
+
+    codes_sorted = sorted(codes)
+    key = _codes_fingerprint(codes_sorted)
+
+    cached = _REPORT_CACHE
+    if cached is not None and cached[0] == key:
+        return cached[1]
+
+    # CHANGED: пишем одну колонку напрямую через xlsxwriter, без DataFrame
+    buf = BytesIO()
+    wb = xlsxwriter.Workbook(buf, {"in_memory": True})
+    ws = wb.add_worksheet("codes")
+    ws.write_string(0, 0, "code")
+    for row, code in enumerate(codes_sorted, start=1):
+        ws.write_string(row, 0, code)
+    wb.close()
+
+    data = buf.getvalue()
+    _REPORT_CACHE = (key, data)
+    return data
+
 
 async def build_printed_codes_report_excel_bytes() -> tuple[bytes, str]:
     """
@@ -18,13 +59,7 @@ async def build_printed_codes_report_excel_bytes() -> tuple[bytes, str]:
     async with config.AsyncSessionLocal() as session:
         codes: set[str] = await get_all_codes(session)
 
-    # делаем DataFrame с одной колонкой
-    df = pd.DataFrame(sorted(codes), columns=["code"])
-
-    buf = BytesIO()
-    with pd.ExcelWriter(buf) as writer:
-        df.to_excel(writer, index=False, sheet_name="codes")
-
-    buf.seek(0)
+    # сортировка и сборка xlsx — CPU-работа, не держим на ней event loop
+    data = await asyncio.to_thread(_build_excel_sync, codes)
     filename = f"printed_codes_{datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}.xlsx"
-    return buf.getvalue(), filename
\ No newline at end of file
+    return data, filename
@@ -5,12 +5,11 @@ from pathlib import Path
 from typing import List, Dict, Any
 import asyncio
 
-import pdfplumber
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from .pdf_rw import _extract_page_code
+from .pdf_rw import _extract_page_code, _pdfium_document, _pdfium_page_count
 from .pdf_splitter import split_pdf_by_meta
-from models.printed_code import PrintedCode
+from services.printed_codes import bulk_delete_codes
 
 
 # --------- sync helpers (уводим в поток) ---------
@@ -18,28 +17,21 @@ from models.printed_code import PrintedCode
 def _collect_all_codes_sync(src_pdf: Path | str) -> List[str]:
     """
     Открывает PDF и проходит по всем страницам, извлекая код функцией
-    core.pdf_rw._extract_page_code(pl_pdf, page_index).
+    core.pdf_rw._extract_page_code(doc, page_index).
     Возвращает список уникальных кодов в порядке появления.
     """
     src = Path(src_pdf)
     if not src.exists():
         raise FileNotFoundError(f"Файл не найден: {src}")
 
-    codes: List[str] = []
-    with pdfplumber.open(str(src)) as pl_pdf:
-        for i in range(len(pl_pdf.pages)):
-            code = _extract_page_code(pl_pdf, i)
+    # dict как упорядоченное множество: дедупликация с сохранением порядка сразу при обходе
+    codes: Dict[str, None] = {}
+    with _pdfium_document(str(src)) as doc:
+        for i in range(_pdfium_page_count(doc)):
+            code = _extract_page_code(doc, i)
             if code:
-                codes.append(code)
-
-    # дедупликация с сохранением порядка
-    seen = set()
-    uniq: List[str] = []
-    for c in codes:
-        if c not in seen:
-            seen.add(c)
-            uniq.append(c)
-    return uniq
+                codes[code] = None
+    return list(codes)
 
 
 # ------------------- main API --------------------
@@ -59,17 +51,18 @@ async def return_pdf(session: AsyncSession, src_pdf: Path | str) -> Dict[str, An
     codes: List[str] = await asyncio.to_thread(_collect_all_codes_sync, src)
 
     # 2) удалить найденные коды из БД (без ошибок, если записи не существует)
+    # CHANGED: один DELETE ... RETURNING вместо get + delete на каждый код
     deleted_codes: List[str] = []
     if codes:
-        for code in codes:
-            row = await session.get(PrintedCode, code)
-            if row:
-                await session.delete(row)
-                deleted_codes.append(code)
+        deleted = await bulk_delete_codes(session, codes)
+        # порядок — как в документе (RETURNING порядок не гарантирует)
+        deleted_codes = [c for c in codes if c in deleted]
         if deleted_codes:
             await session.commit()
 
-    # 3) разрезать и сохранить PDF (тоже уводим в поток)
+    # 3) разрезать и сохранить PDF (тоже уводим в поток).
+    # Строго после commit: нарезанные файлы в PDF_DIR не должны появиться, пока их коды
+    # ещё в printed_codes (иначе при ошибке выше страницы потом отсеются как дубли)
     report = await asyncio.to_thread(split_pdf_by_meta, src)
 
     # 4) результат
@@ -1,12 +1,41 @@
 import re
 from .patterns import GS1_01, GS1_21, COLOR_STOP
 
+# en/em dash -> '-' за один проход (вместо двух replace с промежуточной копией)
+_DASH_TABLE = str.maketrans({"–": "-", "—": "-"})
+
+# regex'ы clean_for_parsing / clean_color_value компилируем один раз при импорте
+_RE_SLASH_NL = re.compile(r"/([A-Za-zА-Яа-яЁё]+)\s*\n\s*([A-Za-zА-Яа-яЁё]+)")
+_RE_HYPHEN_NL = re.compile(r"([A-Za-zА-Яа-яЁё])-\s*\n\s*([A-Za-zА-Яа-яЁё])")
+_RE_WORD_NL = re.compile(r"([A-Za-zА-Яа-яЁё])\s*\n\s*([A-Za-zА-Яа-яЁё])")
+_RE_WS = re.compile(r"[ \t]+")
+_RE_ART_LABEL = re.compile(r"(?<!^)(Артикул)(?=\S)", re.IGNORECASE)
+_RE_COLOR_LABEL = re.compile(r"(?<!^)(Цвет\s*:)(?=\S)", re.IGNORECASE)
+_RE_SIZE_LABEL = re.compile(r"(?<!^)(Размер\s*:)(?=\S)", re.IGNORECASE)
+
+# всё, что не буква/цифра/дефис (включая "_", табы и любые пробелы), — серией в один пробел
+_RE_COLOR_JUNK = re.compile(r"(?:[^\w\-]|_)+")
+_RE_TAIL_LATIN = re.compile(r"(?<=[А-Яа-яЁё])\s*[A-Z]+$")
+
+# классы символов для токенов цвета: токены короткие, set-проверки дешевле вызова regex
+_CYR_OR_DASH = frozenset(
+    [chr(c) for c in range(ord("А"), ord("я") + 1)] + ["Ё", "ё", "-"]
+)
+_ASCII_UPPER = frozenset("ABCDEFGHIJKLMNOPQRSTUVWXYZ")
+_ASCII_LOWER = frozenset("abcdefghijklmnopqrstuvwxyz")
+
+
 def normalize_dashes(text: str) -> str:
-    return (text or "").replace("–", "-").replace("—", "-")
+    return (text or "").translate(_DASH_TABLE)
 
 def strip_gs1(text: str) -> str:
-    t = GS1_01.sub(" ", text or "")
-    t = GS1_21.sub(" ", t)
+    t = text or ""
+    # NEW: без маркера «(01)»/«(21)» regex-проход не нужен — `in` ищет в C за один memchr-проход.
+    # Порядок (сначала 01, потом 21) сохраняем: сериал (21) может упираться прямо в «(01)…»
+    if "(01)" in t:
+        t = GS1_01.sub(" ", t)
+    if "(21)" in t:
+        t = GS1_21.sub(" ", t)
     return t
 
 # def clean_for_parsing(raw: str) -> str:
@@ -26,37 +55,31 @@ def clean_for_parsing(raw: str) -> str:
     """Корректная склейка переносов в артикулах и обычном тексте."""
     t = raw or ""
 
-    # 1) Склейка внутри артикула: после слэша — БЕЗ пробела
-    #    /бир\nюзовый → /бирюзовый
-    t = re.sub(
-        r"/([A-Za-zА-Яа-яЁё]+)\s*\n\s*([A-Za-zА-Яа-яЁё]+)",
-        r"/\1\2",
-        t
-    )
-
-    # 2) Склейка дефиса между частями слов
-    #    темно-\nсиний → темно-синий
-    t = re.sub(
-        r"([A-Za-zА-Яа-яЁё])-\s*\n\s*([A-Za-zА-Яа-яЁё])",
-        r"\1-\2",
-        t
-    )
-
-    # 3) Остальные переносы — превращаем в пробел
-    #    Columbia\nтемно-синий → Columbia темно-синий
-    t = re.sub(
-        r"([A-Za-zА-Яа-яЁё])\s*\n\s*([A-Za-zА-Яа-яЁё])",
-        r"\1 \2",
-        t
-    )
+    # Шаги 1-3 идут строго по очереди: каждый «съедает» букву справа от переноса,
+    # и слитая в один regex версия даёт другое ("a-\nb\nc" -> "a-b\nc" вместо "a-b c").
+    # Зато без "\n" (и без "/" / "-" для шагов 1/2) проход заведомо ничего не меняет.
+    if "\n" in t:
+        # 1) Склейка внутри артикула: после слэша — БЕЗ пробела
+        #    /бир\nюзовый → /бирюзовый
+        if "/" in t:
+            t = _RE_SLASH_NL.sub(r"/\1\2", t)
+
+        # 2) Склейка дефиса между частями слов
+        #    темно-\nсиний → темно-синий
+        if "-" in t:
+            t = _RE_HYPHEN_NL.sub(r"\1-\2", t)
+
+        # 3) Остальные переносы — превращаем в пробел
+        #    Columbia\nтемно-синий → Columbia темно-синий
+        t = _RE_WORD_NL.sub(r"\1 \2", t)
 
     # 4) Нормализация пробелов
-    t = re.sub(r"[ \t]+", " ", t)
+    t = _RE_WS.sub(" ", t)
 
     # 5) Разлепление меток
-    t = re.sub(r"(?<!^)(Артикул)(?=\S)",   r"\n\1 ", t, flags=re.IGNORECASE)
-    t = re.sub(r"(?<!^)(Цвет\s*:)(?=\S)",  r"\n\1 ", t, flags=re.IGNORECASE)
-    t = re.sub(r"(?<!^)(Размер\s*:)(?=\S)", r"\n\1 ", t, flags=re.IGNORECASE)
+    t = _RE_ART_LABEL.sub(r"\n\1 ", t)
+    t = _RE_COLOR_LABEL.sub(r"\n\1 ", t)
+    t = _RE_SIZE_LABEL.sub(r"\n\1 ", t)
 
     return t
 
@@ -69,25 +92,41 @@ def clean_color_value(s: str) -> str:
     4) оставляет до 3 осмысленных слов, приоритет — кириллица
     """
     s = COLOR_STOP.sub("", s or "")
-    s = re.sub(r"[^\w\- А-Яа-яЁё]", " ", s)
-    s = re.sub(r"[_\t]+", " ", s)
-    s = re.sub(r"\s+", " ", s).strip(" -")
+    s = _RE_COLOR_JUNK.sub(" ", s).strip(" -")
     if not s:
         return s
 
     # отбрасываем любые латинские символы в конце строки после кириллицы
-    s = re.sub(r"(?<=[А-Яа-яЁё])\s*[A-Z]+$", "", s)
+    s = _RE_TAIL_LATIN.sub("", s)
 
     tokens = s.split()
     cleaned = []
     for t in tokens:
-        if re.fullmatch(r"[А-Яа-яЁё\-]+", t):
+        chars = set(t)
+        if chars <= _CYR_OR_DASH:
             cleaned.append(t); continue
-        if re.fullmatch(r"[A-Za-z]+", t):
+        # только латиница
+        if t.isascii() and t.isalpha():
             continue
-        if re.search(r"[A-Z]", t) and re.search(r"[a-z]", t):
+        # смешанный регистр латиницы (clSV, rAu, ...)
+        if not chars.isdisjoint(_ASCII_UPPER) and not chars.isdisjoint(_ASCII_LOWER):
             continue
         cleaned.append(t)
 
     cleaned = cleaned[:3]
     return " ".join(cleaned).strip(" -")
+
+
+def collapse_repeats(s: str) -> str:
+    """
+    «XX» → «X»: s целиком из повторов одного куска (дубли при склейке переносов) —
+    оставляем кусок (самый короткий). Линейная проверка делителей длины вместо
+    backtracking-regex (.+?)\\1+; как и у regex, строки с переводом строки не трогаем.
+    """
+    n = len(s)
+    if n < 2 or "\n" in s:
+        return s
+    for d in range(1, n // 2 + 1):
+        if n % d == 0 and s[:d] * (n // d) == s:
+            return s[:d]
+    return s
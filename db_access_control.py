@@ -1,3 +1,4 @@
+import time
 from typing import Callable, Awaitable, Dict, Any
 from aiogram import BaseMiddleware
 from aiogram.types import TelegramObject, Message, CallbackQuery
@@ -7,8 +8,13 @@ from services.access_service import is_user_allowed
 
 
 class DBAccessControlMiddleware(BaseMiddleware):
-    def __init__(self, session_factory: async_sessionmaker):
+    def __init__(self, session_factory: async_sessionmaker, cache_ttl: float = 60.0):
         self.session_factory = session_factory
+        # NEW: user_id -> момент (monotonic), до которого доступ считаем подтверждённым.
+        # Кешируем только «разрешено»: отказ и ошибки БД всегда перепроверяются,
+        # а посторонние пользователи не раздувают кеш.
+        self._allowed_until: Dict[int, float] = {}
+        self._ttl = cache_ttl
 
     async def __call__(
         self,
@@ -22,6 +28,12 @@ class DBAccessControlMiddleware(BaseMiddleware):
         if user is None:
             return await handler(event, data)
 
+        now = time.monotonic()
+        until = self._allowed_until.get(user.id)
+        if until is not None and until > now:
+            # доступ недавно подтверждён — без похода в БД
+            return await handler(event, data)
+
         # Проверка доступа через короткоживущую сессию (без глобальной)
         try:
             async with self.session_factory() as session:
@@ -31,6 +43,11 @@ class DBAccessControlMiddleware(BaseMiddleware):
             print(f"[DBAccessControl] DB error while checking access for user {user.id}: {e}")
             allowed = False
 
+        if allowed:
+            self._allowed_until[user.id] = now + self._ttl
+        else:
+            self._allowed_until.pop(user.id, None)
+
         if not allowed:
             if isinstance(event, CallbackQuery):
                 try:
@@ -20,4 +20,6 @@ class OrderLog(Base):
     shortage = Column(Integer, nullable=False, default=0)
     created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
 
-    user = relationship("AllowedUser", back_populates="logs", lazy="joined")
+    # selectin: без LEFT OUTER JOIN allowed_users в каждом запросе логов —
+    # пользователи догружаются одним SELECT ... IN по уже выбранным user_id
+    user = relationship("AllowedUser", back_populates="logs", lazy="selectin")
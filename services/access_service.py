@@ -1,4 +1,4 @@
-from sqlalchemy import select
+from sqlalchemy import exists, select
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from models import UserRole
@@ -8,10 +8,11 @@ async def is_user_allowed(session: AsyncSession, user_id: int) -> bool:
     """
     Проверяет, есть ли пользователь в таблице allowed_users.
     """
+    # SELECT EXISTS(...) — Postgres останавливается на попадании в индекс, строку не тащим
     result = await session.execute(
-        select(AllowedUser.user_id).where(AllowedUser.user_id == user_id)
+        select(exists().where(AllowedUser.user_id == user_id))
     )
-    return result.scalar_one_or_none() is not None
+    return bool(result.scalar())
 
 
 
@@ -1,6 +1,6 @@
 import re
-from collections import defaultdict
-from typing import Optional, Dict, List, Tuple
+from collections import defaultdict, deque
+from typing import Optional, Dict, Deque, Tuple
 
 import pandas as pd
 from sqlalchemy import insert
@@ -12,27 +12,40 @@ from services.access_service import is_user_allowed
 REQUIRED_COLS = {"артикул", "размер", "количество"}
 
 
+def parse_qty(value) -> Optional[int]:
+    """
+    Количество из ячейки заказа: int(value), иначе None (строку пропускаем).
+    Общий разбор для сборки PDF (core.pdf_rw) и журнала заказов — чтобы они
+    одинаково трактовали NaN/inf/"5.0" и т.п.
+    """
+    try:
+        return int(value)
+    except Exception:
+        return None
+
+
+# CHANGED: разбираем весь отчёт одним finditer (MULTILINE) вместо splitlines + match на строку.
+# Пробелы — только горизонтальные ([^\S\n]), а размер без \n: совпадение не выходит за строку.
+# re.ASCII: разделители в строке отчёта (pdf_rw) — обычные пробелы; \xa0 и пр. из данных
+# могут попасть только в артикул/размер, а они всё равно .strip()-ятся
 _RE_RU = re.compile(
-    r"^\s*(?P<art>.+?)\s*-\s*размер:\s*(?P<size>[^,]+)\s*,\s*не хватило:\s*(?P<n>\d+)\s*$"
+    r"^[^\S\n]*(?P<art>.+?)[^\S\n]*-[^\S\n]*размер:[^\S\n]*(?P<size>[^,\n]+)[^\S\n]*,"
+    r"[^\S\n]*не хватило:[^\S\n]*(?P<n>\d+)[^\S\n]*$",
+    re.MULTILINE | re.ASCII,
 )
-def _parse_shortages_report(report: Optional[str]) -> Dict[Tuple[str, str], List[int]]:
+def _parse_shortages_report(report: Optional[str]) -> Dict[Tuple[str, str], Deque[int]]:
     """
     Возвращает карту {(art, size_str): [n1, n2, ...]}.
     Поддерживает строки:
       - "AAA:42 не хватило: 2"
       - "AAA - размер: 42, не хватило: 2"
     """
-    out: Dict[Tuple[str, str], List[int]] = defaultdict(list)
+    # deque: потребитель забирает значения по порядку через popleft() за O(1)
+    out: Dict[Tuple[str, str], Deque[int]] = defaultdict(deque)
     if not report:
         return out
 
-    for raw in report.splitlines():
-        line = raw.strip()
-        if not line:
-            continue
-        m = _RE_RU.match(line)
-        if not m:
-            continue
+    for m in _RE_RU.finditer(report):
         art = m.group("art").strip()
         size = str(m.group("size")).strip()   # ключ всегда строкой
         n = int(m.group("n"))
@@ -41,25 +54,27 @@ def _parse_shortages_report(report: Optional[str]) -> Dict[Tuple[str, str], List
     return out
 
 async def log_orders_from_df(df: pd.DataFrame, shortages_report: Optional[str], user_id: int) -> int:
-    df = df.copy()
-    df.columns = [str(c).strip().lower() for c in df.columns]
-    if not REQUIRED_COLS.issubset(set(df.columns)):
-        missing = REQUIRED_COLS - set(df.columns)
+    # CHANGED: без df.copy() — нормализованное имя -> исходная колонка, df вызывающего не трогаем
+    cols = {str(c).strip().lower(): c for c in df.columns}
+    if not REQUIRED_COLS.issubset(cols):
+        missing = REQUIRED_COLS - set(cols)
         raise ValueError(f"В df нет обязательных колонок: {', '.join(missing)}")
 
     shortages_map = _parse_shortages_report(shortages_report)
 
     rows = []
-    for _, row in df.iterrows():
-        art = str(row["артикул"]).strip()
-        size_str = str(row["размер"]).strip()
-        try:
-            qty_req = int(row["количество"])
-        except Exception:
+    # CHANGED: вместо df.iterrows() (Series на каждую строку) — zip по трём колонкам
+    for art_raw, size_raw, qty_raw in zip(
+        df[cols["артикул"]].tolist(), df[cols["размер"]].tolist(), df[cols["количество"]].tolist()
+    ):
+        art = str(art_raw).strip()
+        size_str = str(size_raw).strip()
+        qty_req = parse_qty(qty_raw)
+        if qty_req is None:
             continue
 
 
-        short = int(shortages_map[(art, size_str)].pop(0)) if shortages_map.get((art, size_str)) else 0
+        short = int(shortages_map[(art, size_str)].popleft()) if shortages_map.get((art, size_str)) else 0
         qty_sent = max(qty_req - short, 0)
 
         rows.append({
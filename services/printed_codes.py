@@ -1,6 +1,6 @@
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
-from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy import String, bindparam, delete, func, select
+from sqlalchemy.dialects.postgresql import ARRAY, insert as pg_insert
 
 from models.printed_code import PrintedCode
 
@@ -31,23 +31,54 @@ async def register_code_if_new(session: AsyncSession, code: str) -> bool:
 
 async def get_all_codes(session: AsyncSession) -> set[str]:
     res = await session.execute(select(PrintedCode.code))
-    return {row[0] for row in res.fetchall() if row[0]}
+    # scalars() — без обёртки Row на каждую строку; code — PK (NOT NULL), отсеиваем только ""
+    codes = set(res.scalars())
+    codes.discard("")
+    return codes
 
 
 
+# NEW: пачка кодов на один INSERT — ограничивает размер запроса и время одного round-trip
+_INSERT_CHUNK = 5000
+
+
 async def bulk_register_codes(session: AsyncSession, codes: set[str]) -> int:
     """
     Массовая регистрация кодов. Возвращает, сколько реально вставлено.
+    Вставляем пачками по _INSERT_CHUNK в текущей транзакции (commit — у вызывающего).
     """
     if not codes:
         return 0
+    codes_list = list(codes)
+    inserted = 0
+    for i in range(0, len(codes_list), _INSERT_CHUNK):
+        chunk = codes_list[i:i + _INSERT_CHUNK]
+        # CHANGED: INSERT ... SELECT unnest(:codes) — вся пачка одним параметром-массивом,
+        # без dict на каждую строку и отдельного bind-параметра на каждый код
+        codes_param = bindparam("codes", chunk, type_=ARRAY(String))
+        stmt = (
+            pg_insert(PrintedCode)
+            .from_select(["code"], select(func.unnest(codes_param)))
+            .on_conflict_do_nothing(index_elements=["code"])
+            .returning(PrintedCode.code)
+        )
+        res = await session.execute(stmt)
+        # сколько вернулось — столько реально вставилось
+        inserted += len(res.scalars().all())
+    return inserted
+
+
+async def bulk_delete_codes(session: AsyncSession, codes: list[str]) -> set[str]:
+    """
+    Массовое удаление кодов одним DELETE ... RETURNING.
+    Возвращает коды, которые реально были в таблице и удалены.
+    """
+    if not codes:
+        return set()
     stmt = (
-        pg_insert(PrintedCode)
-        .values([{"code": c} for c in codes])
-        .on_conflict_do_nothing(index_elements=["code"])
+        delete(PrintedCode)
+        .where(PrintedCode.code.in_(codes))
         .returning(PrintedCode.code)
     )
     res = await session.execute(stmt)
-    # сколько вернулось — столько реально вставилось
-    inserted = [row[0] for row in res.fetchall()]
-    return len(inserted)
\ No newline at end of file
+    return {row[0] for row in res.fetchall()}